@@ -1,11 +1,54 @@
+import warnings
 import torch as tc
 from torch import Tensor
-from typing import List, Sequence, Protocol
+from itertools import chain
+from typing import Dict, Iterator, List, Sequence, Protocol, Tuple
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+try:
+    from pykeops.torch import LazyTensor
+except ImportError:
+    LazyTensor = None
 
-tc.set_default_tensor_type(tc.DoubleTensor)
 tc.set_printoptions(precision=7, sci_mode=True)
 
 
+def _sq_exp(sqd: Tensor, sig: Tensor) -> Tensor:
+    """
+     sig^2 * exp(-sqd) for batched sqd[nb, m, n], computed in place
+     in sqd.
+    """
+    return sqd.neg_().exp_().mul_(sig.square()[:, None, None])
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _sq_exp_grad(x, ls, krn, out):
+        """
+         Lengthscale derivatives of the squared exponential kernel,
+         out[b, d, i, j] = -2 ls[b, d] (x[b, i, d] - x[b, j, d])^2 K[b, i, j],
+         written in a single pass over each n x n tile.
+        """
+        nc, n, dim = x.shape
+        for b in range(nc):
+            for i in prange(n):
+                for j in range(n):
+                    for d in range(dim):
+                        diff = x[b, i, d] - x[b, j, d]
+                        out[b, d, i, j] = (
+                            -2.0 * ls[b, d] * diff * diff * krn[b, i, j]
+                        )
+
+
+else:
+    _sq_exp_grad = None
+
+
 class Covar(Protocol):
     """
      Protocol for covariance kernels for Gaussian process
@@ -21,7 +64,19 @@ class Covar(Protocol):
     def kernel(self, params: Tensor, x: Tensor, xp: Tensor = None) -> Tensor:
         ...
 
-    def kernel_and_grad(self, params: Tensor, x: Tensor) -> List[Tensor]:
+    def kernel_and_grad(
+        self, params: Tensor, x: Tensor, out: Tensor = None
+    ) -> List[Tensor]:
+        ...
+
+    def kernel_and_grad_iter(
+        self, params: Tensor, x: Tensor
+    ) -> Tuple[Tensor, Iterator[Tensor]]:
+        ...
+
+    def kernel_mv(
+        self, params: Tensor, x: Tensor, v: Tensor, xp: Tensor = None
+    ) -> Tensor:
         ...
 
 
@@ -32,10 +87,21 @@ class Compose:
 
     def __init__(self, covars: Sequence[Covar]) -> None:
         self.covars = covars
+        self._chunks: Dict[int, List[int]] = {}
+
+    def _get_chunks(self, x: Tensor) -> List[int]:
+
+        dim = x.shape[-1]
+        if dim not in self._chunks:
+            self._chunks[dim] = [
+                covar.get_params_shape(x)[-1] for covar in self.covars
+            ]
+
+        return self._chunks[dim]
 
     def get_params_shape(self, x: Tensor) -> List[int]:
 
-        nparams = sum([covar.get_params_shape(x)[-1] for covar in self.covars])
+        nparams = sum(self._get_chunks(x))
         shape = list(x.shape)
         shape[-1] = nparams
         shape.pop(-2)
@@ -49,9 +115,9 @@ class Compose:
 
     def kernel(self, hp: Tensor, x: Tensor, xp: Tensor = None) -> Tensor:
 
-        assert hp.shape[-1] == self.get_params_shape(x)[-1]
+        chunks = self._get_chunks(x)
+        assert hp.shape[-1] == sum(chunks)
 
-        chunks = [covar.get_params_shape(x)[-1] for covar in self.covars]
         params = hp.split(chunks, dim=-1)
 
         krn = self.covars[0].kernel(params[0], x, xp)
@@ -61,31 +127,95 @@ class Compose:
 
         return krn
 
-    def kernel_and_grad(self, hp: Tensor, x: Tensor) -> List[Tensor]:
+    def kernel_and_grad(
+        self, hp: Tensor, x: Tensor, out: Tensor = None
+    ) -> List[Tensor]:
 
-        assert hp.shape[-1] == self.get_params_shape(x)[-1]
+        chunks = self._get_chunks(x)
+        assert hp.shape[-1] == sum(chunks)
 
-        chunks = [covar.get_params_shape(x)[-1] for covar in self.covars]
         params = hp.split(chunks, dim=-1)
 
-        dkrns = []
-        krn, dkrn1 = self.covars[0].kernel_and_grad(params[0], x)
-        dkrns.append(dkrn1)
+        n = x.shape[-2]
+        if out is None:
+            dkrn = x.new_empty(self.get_params_shape(x) + [n, n])
+        else:
+            dkrn = out
 
-        for i in range(1, len(self.covars)):
-            krn.add_(self.covars[i].kernel_and_grad(params[i], x)[0])
-            dkrns.append(self.covars[i].kernel_and_grad(params[i], x)[1])
+        krn = self.covars[0].kernel_and_grad(
+            params[0], x, out=dkrn[..., : chunks[0], :, :]
+        )[0]
+        offset = chunks[0]
 
-        dkrn = tc.cat(dkrns, dim=-3)
+        for i in range(1, len(self.covars)):
+            krn_i = self.covars[i].kernel_and_grad(
+                params[i], x, out=dkrn[..., offset : offset + chunks[i], :, :]
+            )[0]
+            krn.add_(krn_i)
+            offset += chunks[i]
 
         return [krn, dkrn]
 
+    def kernel_and_grad_iter(
+        self, hp: Tensor, x: Tensor
+    ) -> Tuple[Tensor, Iterator[Tensor]]:
+
+        chunks = self._get_chunks(x)
+        assert hp.shape[-1] == sum(chunks)
+
+        params = hp.split(chunks, dim=-1)
+
+        krn, dkrn_iter = self.covars[0].kernel_and_grad_iter(params[0], x)
+        dkrn_iters = [dkrn_iter]
+
+        for i in range(1, len(self.covars)):
+            krn_i, dkrn_iter = self.covars[i].kernel_and_grad_iter(
+                params[i], x
+            )
+            krn = krn.add(krn_i)
+            dkrn_iters.append(dkrn_iter)
+
+        return krn, chain.from_iterable(dkrn_iters)
+
+    def kernel_mv(
+        self, hp: Tensor, x: Tensor, v: Tensor, xp: Tensor = None
+    ) -> Tensor:
+
+        chunks = self._get_chunks(x)
+        assert hp.shape[-1] == sum(chunks)
+
+        params = hp.split(chunks, dim=-1)
+
+        kv = self.covars[0].kernel_mv(params[0], x, v, xp)
+
+        for i in range(1, len(self.covars)):
+            kv.add_(self.covars[i].kernel_mv(params[i], x, v, xp))
+
+        return kv
+
 
 class Squared_exponential:
     """
      Squared exponential covariance K(x,x') = sig_y * exp(-|(x-x').ls|^2)
     """
 
+    def __init__(
+        self,
+        use_keops: bool = False,
+        exact_distance: bool = False,
+        use_compile: bool = False,
+    ) -> None:
+        if use_keops and LazyTensor is None:
+            warnings.warn(
+                "pykeops is not installed, Squared_exponential falls back"
+                " to dense kernel_mv",
+                RuntimeWarning,
+            )
+        self.use_keops = use_keops and LazyTensor is not None
+        self.exact_distance = exact_distance
+        self.use_compile = use_compile
+        self._sq_exp = tc.compile(_sq_exp) if use_compile else _sq_exp
+
     def get_params_shape(self, x: Tensor) -> List[int]:
 
         shape = list(x.shape)
@@ -96,33 +226,51 @@ class Squared_exponential:
     def init_params(self, x: Tensor) -> Tensor:
 
         shape = self.get_params_shape(x)
-        params = tc.ones(shape)
+        params = x.new_ones(shape)
         return params
 
+    def _scale(self, hp: Tensor, x: Tensor) -> List[Tensor]:
+
+        hp = hp.reshape((-1, hp.shape[-1]))
+
+        sig = hp[:, 0]
+        ls = hp[:, 1:]
+        xl = x.reshape((-1, x.shape[-2], x.shape[-1])).mul(ls[:, None, :])
+
+        return [sig, ls, xl]
+
     def distance(self, x: Tensor, xp: Tensor = None) -> Tensor:
 
-        x = x.view((-1, x.shape[-2], x.shape[-1]))
+        x = x.reshape((-1, x.shape[-2], x.shape[-1]))
+
+        if self.exact_distance:
+            if xp is None:
+                xp = x
+            else:
+                xp = xp.reshape((-1, xp.shape[-2], xp.shape[-1]))
+
+            sqd = tc.cdist(xp, x, compute_mode="donot_use_mm_for_euclid_dist")
+
+            return sqd.square_().squeeze(0)
 
         x2 = tc.sum(x.square(), 2)
 
         if xp is None:
 
-            sqd = -2.0 * tc.matmul(x, x.transpose(1, 2)) + x2.unsqueeze(2).add(
-                x2.unsqueeze(1)
-            )
+            sqd = x2.unsqueeze(2).add(x2.unsqueeze(1))
+            sqd.baddbmm_(x, x.transpose(1, 2), alpha=-2.0)
 
         else:
-            xp = xp.view((-1, xp.shape[-2], xp.shape[-1]))
-
-            xp2 = tc.sum(xp.square(), 2)
+            xp = xp.reshape((-1, xp.shape[-2], xp.shape[-1]))
 
-            sqd = -2.0 * tc.matmul(xp, x.transpose(1, 2)) + xp2.unsqueeze_(
-                2
-            ).add(x2.unsqueeze_(1))
+            nb = max(x.shape[0], xp.shape[0])
+            x = x.expand(nb, -1, -1)
+            xp = xp.expand(nb, -1, -1)
 
-            xp.squeeze_(0)
+            xp2 = tc.sum(xp.square(), 2)
 
-        x.squeeze_(0)
+            sqd = xp2.unsqueeze(2).add(x2.unsqueeze(1))
+            sqd.baddbmm_(xp, x.transpose(1, 2), alpha=-2.0)
 
         return sqd.squeeze(0)
 
@@ -130,80 +278,127 @@ class Squared_exponential:
 
         assert hp.shape[-1] == self.get_params_shape(x)[-1]
 
-        x = x.view((-1, x.shape[-2], x.shape[-1]))
-
-        hp = hp.view((-1, hp.shape[-1]))
-
-        sig = hp[:, 0]
-        ls = hp[:, 1:]
-        ls.unsqueeze_(1)
-        xl = x.mul(ls)
+        sig, ls, xl = self._scale(hp, x)
 
         if xp is None:
             sqd = self.distance(xl)
 
             sqd = sqd.view((-1, sqd.shape[-2], sqd.shape[-1]))
-
-            sqd.mul_(-1.0)
-            sqd.exp_()
-            sqd.mul_(sig[:, None, None].square())
+            sqd = self._sq_exp(sqd, sig)
 
         else:
-            xp = xp.view((-1, xp.shape[-2], xp.shape[-1]))
-            xpl = xp.mul(ls)
+            xp = xp.reshape((-1, xp.shape[-2], xp.shape[-1]))
+            xpl = xp.mul(ls[:, None, :])
 
             sqd = self.distance(xl, xp=xpl)
             sqd = sqd.view((-1, sqd.shape[-2], sqd.shape[-1]))
+            sqd = self._sq_exp(sqd, sig)
 
-            sqd.mul_(-1.0)
-            sqd.exp_()
-            sqd.mul_(sig[:, None, None].square())
-
-        hp.squeeze_(0)
-        x.squeeze_(0)
-
-        sqd.squeeze_(0)
-
-        return sqd
+        return sqd.squeeze(0)
 
-    def kernel_and_grad(self, hp: Tensor, x: Tensor) -> List[Tensor]:
+    def kernel_and_grad(
+        self, hp: Tensor, x: Tensor, out: Tensor = None
+    ) -> List[Tensor]:
 
         assert hp.shape[-1] == self.get_params_shape(x)[-1]
 
-        krn = self.kernel(hp, x)
+        sig, ls, xl = self._scale(hp, x)
 
-        hp = hp.view((-1, hp.shape[-1]))
+        sqd = self.distance(xl)
+        sqd = sqd.view((-1, sqd.shape[-2], sqd.shape[-1]))
+        krn = self._sq_exp(sqd, sig)
 
-        x = x.view((-1, x.shape[-2], x.shape[-1]))
-        krn = krn.view((-1, krn.shape[-2], krn.shape[-1]))
+        x = x.reshape((-1, x.shape[-2], x.shape[-1]))
 
         nc = x.shape[0]
         nhp = hp.shape[-1]
         n = krn.shape[-1]
 
-        dkrn = tc.empty([nc, nhp, n, n])
-
-        sig = hp[:, 0]
-        ls = hp[:, 1:]
+        if out is None:
+            dkrn = x.new_empty([nc, nhp, n, n])
+        else:
+            dkrn = out.view([nc, nhp, n, n])
 
         dkrn[:, 0, :, :] = krn.mul(sig[:, None, None].reciprocal().mul_(2.0))
 
-        xt = x.transpose(-2, -1)
-        diff = xt[:, :, :, None].sub(xt[:, :, None, :])
+        diff = dkrn[:, 1:, :, :]
 
-        diff.square_()
-        diff.mul_(ls[:, :, None, None])
-        diff.mul_(krn[:, None, :, :])
-        diff.mul_(-2.0)
+        if (
+            _sq_exp_grad is not None
+            and x.device.type == "cpu"
+            and not (x.requires_grad or hp.requires_grad)
+        ):
+            _sq_exp_grad(x.numpy(), ls.numpy(), krn.numpy(), diff.numpy())
 
-        dkrn[:, 1:, :, :] = diff
+        else:
+            xt = x.transpose(-2, -1)
+            tc.sub(xt[:, :, :, None], xt[:, :, None, :], out=diff)
 
-        x.squeeze_(0)
-        hp.squeeze_(0)
-        krn.squeeze_(0)
-        dkrn.squeeze_(0)
+            diff.square_()
+            diff.mul_(ls.mul(-2.0)[:, :, None, None])
+            diff.mul_(krn[:, None, :, :])
 
-        return [krn, dkrn]
+        return [krn.squeeze(0), dkrn.squeeze(0)]
+
+    def kernel_and_grad_iter(
+        self, hp: Tensor, x: Tensor
+    ) -> Tuple[Tensor, Iterator[Tensor]]:
+
+        assert hp.shape[-1] == self.get_params_shape(x)[-1]
+
+        sig, ls, xl = self._scale(hp, x)
+
+        sqd = self.distance(xl)
+        sqd = sqd.reshape((-1, sqd.shape[-2], sqd.shape[-1]))
+        krn = self._sq_exp(sqd, sig)
+
+        return krn.squeeze(0), self._grad_iter(sig, ls, x, krn)
+
+    def _grad_iter(
+        self, sig: Tensor, ls: Tensor, x: Tensor, krn: Tensor
+    ) -> Iterator[Tensor]:
+
+        x = x.reshape((-1, x.shape[-2], x.shape[-1]))
+
+        yield krn.mul(sig[:, None, None].reciprocal().mul_(2.0)).squeeze(0)
+
+        for d in range(x.shape[-1]):
+            xd = x[:, :, d]
+            dkrn = xd[:, :, None].sub(xd[:, None, :])
+
+            dkrn.square_()
+            dkrn.mul_(ls[:, d, None, None].mul(-2.0))
+            dkrn.mul_(krn)
+
+            yield dkrn.squeeze(0)
+
+    def kernel_mv(
+        self, hp: Tensor, x: Tensor, v: Tensor, xp: Tensor = None
+    ) -> Tensor:
+
+        assert hp.shape[-1] == self.get_params_shape(x)[-1]
+
+        if not self.use_keops:
+            krn = self.kernel(hp, x, xp)
+            return tc.matmul(krn, v[..., None]).squeeze_(-1)
+
+        sig, ls, xl = self._scale(hp, x)
+
+        if xp is None:
+            xpl = xl
+        else:
+            xpl = xp.reshape((-1, xp.shape[-2], xp.shape[-1]))
+            xpl = xpl.mul(ls[:, None, :])
+
+        x_i = LazyTensor(xpl[:, :, None, :].contiguous())
+        x_j = LazyTensor(xl[:, None, :, :].contiguous())
+
+        krn = (-(x_i - x_j).sqnorm2()).exp()
+        kv = krn @ v.reshape((-1, v.shape[-1], 1)).contiguous()
+
+        kv = kv.squeeze(-1).mul_(sig.square()[:, None])
+
+        return kv.squeeze(0)
 
 
 class White_noise:
@@ -221,35 +416,47 @@ class White_noise:
     def init_params(self, x: Tensor) -> Tensor:
 
         shape = self.get_params_shape(x)
-        params = 1e-4 * tc.ones(shape)
+        params = 1e-4 * x.new_ones(shape)
         return params
 
     def kernel(self, hp: Tensor, x: Tensor, xp: Tensor = None) -> Tensor:
 
         if xp is None:
-            hpb = hp.view(-1, hp.shape[-1])
+            hpb = hp.reshape(-1, hp.shape[-1])
 
             nc = hpb.shape[0]
             n = x.shape[-2]
 
             sig_n = hpb[:, 0]
 
-            krn = tc.empty([nc, n, n]).copy_(tc.eye(n))
-            krn.mul_(sig_n[:, None, None].square())
+            krn = x.new_zeros([nc, n, n])
+            krn.diagonal(dim1=-2, dim2=-1).copy_(sig_n[:, None].square())
 
-            krn.squeeze_(0)
+            krn = krn.squeeze(0)
 
         else:
-            krn = tc.tensor(0)
+            krn = x.new_tensor(0)
 
         return krn
 
-    def kernel_and_grad(self, hp: Tensor, x: Tensor) -> List[Tensor]:
+    def kernel_mv(
+        self, hp: Tensor, x: Tensor, v: Tensor, xp: Tensor = None
+    ) -> Tensor:
+
+        if xp is None:
+            kv = v.mul(hp[..., :1].square())
+        else:
+            kv = v.new_zeros(v.shape[:-1] + xp.shape[-2:-1])
+
+        return kv
+
+    def kernel_and_grad(
+        self, hp: Tensor, x: Tensor, out: Tensor = None
+    ) -> List[Tensor]:
 
-        hpb = hp.view(-1, hp.shape[-1])
+        hpb = hp.reshape(-1, hp.shape[-1])
 
         krn = self.kernel(hp, x)
-        krnb = krn.view(-1, krn.shape[-2], krn.shape[-1])
 
         nc = hpb.shape[0]
         n = krn.shape[-1]
@@ -257,16 +464,24 @@ class White_noise:
 
         sig_n = hpb[:, 0]
 
-        dkrn = tc.empty([nc, nhp, n, n])
+        if out is None:
+            dkrn = x.new_zeros([nc, nhp, n, n])
+        else:
+            dkrn = out.view([nc, nhp, n, n]).zero_()
 
-        dkrn[:, 0, :, :] = krnb.mul(
-            sig_n[:, None, None].reciprocal().mul_(2.0)
+        dkrn[:, 0, :, :].diagonal(dim1=-2, dim2=-1).copy_(
+            sig_n[:, None].mul(2.0)
         )
 
-        krn.squeeze_(0)
-        dkrn.squeeze_(0)
+        return [krn.squeeze(0), dkrn.squeeze(0)]
 
-        return [krn, dkrn]
+    def kernel_and_grad_iter(
+        self, hp: Tensor, x: Tensor
+    ) -> Tuple[Tensor, Iterator[Tensor]]:
+
+        krn, dkrn = self.kernel_and_grad(hp, x)
+
+        return krn, iter(dkrn.unbind(-3))
 
 
 # Docs here
@@ -319,6 +534,11 @@ x: Tensor[..., n, dim]
 hp: Tensor[..., nhp]
     Batched hyperparameters at which the derivative is taken.
     if None, the object internal Covar.hyper_parameter is used.
+out: Tensor[..., nhp, n, n], optional
+    Buffer the derivative is written into, e.g. a slice of a larger
+    gradient stack. It may be strided, but must be viewable as
+    [nc, nhp, n, n] with nc the flattened batch size. If None a new
+    tensor is allocated.
 
 Returns
 -------
@@ -326,6 +546,69 @@ Tensor[..., nhp, n, n]
     Batched matrix derivative wrt each hyperparameter.
 """
 
+Covar.kernel_and_grad_iter.__doc__ = """
+Covariance kernel and an iterator over its derivatives wrt each
+hyperparameter. The derivative matrices are computed one at a time as
+the iterator is consumed, so only one of them needs to be held in
+memory, instead of the full stack returned by :obj:kernel_and_grad.
+
+Parameters
+----------
+params: Tensor[shape]
+    Kernel hyperparameters of shape given by :obj:get_params_shape(x)
+x: Tensor[..., n, dim]
+    Batched training samples
+
+Returns
+-------
+Tensor[..., n, n], Iterator[Tensor[..., n, n]]
+    Batched kernel matrix and the batched matrix derivatives wrt each
+    hyperparameter in turn. The derivatives may be computed from the
+    returned kernel, so it must not be modified in place until the
+    iterator is exhausted.
+"""
+
+Covar.kernel_mv.__doc__ = """
+Product of the covariance kernel matrix with a vector,
+:math:`K(x',x) v`, without requiring the caller to form K(x',x).
+
+Parameters
+----------
+params: Tensor[shape]
+    Kernel hyperparameters of shape given by :obj:get_params_shape(x)
+x: Tensor[..., n, dim]
+    Batched training samples.
+v: Tensor[..., n]
+    Batched vector multiplied from the right.
+xp: Tensor[..., m, dim]
+    Batched test samples. If None, xp = x.
+
+Returns
+-------
+Tensor[..., m]
+    Batched kernel-vector product.
+"""
+
+Squared_exponential.__init__.__doc__ = """
+Squared exponential covariance kernel.
+
+Parameters
+----------
+use_keops: bool, optional
+    If True and pykeops is installed, :obj:kernel_mv evaluates the
+    kernel symbolically with KeOps LazyTensors and never stores the
+    m x n kernel matrix. Without pykeops a RuntimeWarning is issued
+    and the dense kernel is used.
+exact_distance: bool, optional
+    If True, :obj:distance sums the squared differences directly with
+    tc.cdist instead of expanding |x|^2 + |x'|^2 - 2 x.x'. This avoids
+    cancellation for nearby points but is slower than the matmul form.
+use_compile: bool, optional
+    If True, the elementwise sig^2 * exp(-d) pass of the kernel is
+    compiled with tc.compile, which pays off for n of about 1000 and
+    above. The first call of each new shape triggers a compilation.
+"""
+
 Squared_exponential.distance.__doc__ = """
 Euclidean distance matrix between x and xp.
 
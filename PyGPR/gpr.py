@@ -4,10 +4,36 @@
 
 import torch as tc
 from torch import Tensor
-from typing import Sequence
+from typing import Dict, List, Sequence, Tuple
 from .covar import Covar
 
-tc.set_default_tensor_type(tc.DoubleTensor)
+
+def cholesky(krn: Tensor, upcast: bool = False) -> Tensor:
+    """
+     Cholesky factor of krn in the dtype of krn. If upcast, the
+     factorisation is done in double precision and cast back. Retried
+     on the CPU if the device runs out of memory.
+    """
+    krnf = krn.double() if upcast else krn
+    try:
+        return tc.linalg.cholesky(krnf).to(krn.dtype)
+    except RuntimeError as err:
+        if "out of memory" not in str(err) or krn.device.type == "cpu":
+            raise
+        return tc.linalg.cholesky(krnf.cpu()).to(krn)
+
+
+def add_jitter(krn: Tensor) -> Tensor:
+    """
+     Add jitter to the diagonal of krn in place. The jitter is 1e-7, or
+     n * eps times the largest diagonal entry if that is larger, so it
+     stays above the rounding error of single precision kernels.
+    """
+    diag = krn.diagonal(dim1=-2, dim2=-1)
+    eps = tc.finfo(krn.dtype).eps
+    jit = diag.amax(-1, keepdim=True).mul_(krn.shape[-1] * eps)
+    diag.add_(jit.clamp_(min=1e-7))
+    return krn
 
 
 class GPR:
@@ -15,19 +41,47 @@ class GPR:
      Base class for Gaussian process regression models.
     """
 
-    def __init__(self, x: Tensor, y: Tensor, cov: Covar) -> None:
-        self.x: Tensor = x
-        self.y: Tensor = y
+    def __init__(
+        self,
+        x: Tensor,
+        y: Tensor,
+        cov: Covar,
+        device: str = None,
+        dtype: tc.dtype = tc.float64,
+        upcast: bool = False,
+    ) -> None:
+        self.x: Tensor = x.to(device=device, dtype=dtype)
+        self.y: Tensor = y.to(device=device, dtype=dtype)
         self.cov = cov
+        self.upcast: bool = upcast
 
         self.params: Tensor = NotImplemented
         self.need_upd: bool = True
 
+        self._scratch: Dict[str, Tensor] = {}
+
+        return None
+
+    def scratch(self, name: str, shape: List[int]) -> Tensor:
+        buf = self._scratch.get(name)
+        if (
+            buf is None
+            or list(buf.shape) != list(shape)
+            or buf.dtype != self.x.dtype
+            or buf.device != self.x.device
+        ):
+            buf = self.x.new_empty(shape)
+            self._scratch[name] = buf
+        return buf
+
+    def release_scratch(self) -> None:
+        self._scratch.clear()
         return None
 
     def set_params(self, params: Tensor) -> None:
-        self.params = tc.clone(params)
+        self.params = tc.clone(params).to(self.x)
         self.need_upd = True
+        self.release_scratch()
         return None
 
     def update(self) -> None:
@@ -48,16 +102,29 @@ class Exact_GP(GPR):
      Exact GP model.
     """
 
-    def __init__(self, x: Tensor, y: Tensor, cov: Covar) -> None:
-
-        super().__init__(x, y, cov)
+    def __init__(
+        self,
+        x: Tensor,
+        y: Tensor,
+        cov: Covar,
+        device: str = None,
+        dtype: tc.dtype = tc.float64,
+        upcast: bool = False,
+    ) -> None:
+
+        super().__init__(
+            x, y, cov, device=device, dtype=dtype, upcast=upcast
+        )
 
-        self.params: Tensor = cov.init_params(x)
+        self.params: Tensor = cov.init_params(self.x)
 
         self.krn: Tensor = NotImplemented
         self.wt: Tensor = NotImplemented
         self.krnchd: Tensor = NotImplemented
 
+        self._krnss: Tensor = NotImplemented
+        self._krnss_key: Tuple[Tensor, int, Tensor, int] = (None, -1, None, -1)
+
         self.need_upd: bool = True
 
         return None
@@ -65,17 +132,24 @@ class Exact_GP(GPR):
     def update(self) -> None:
         if self.need_upd:
             self.krn = self.cov.kernel(self.params, self.x)
-            self.krn.diagonal(dim1=-2, dim2=-1).add_(1e-7)
-            self.krnchd = tc.cholesky(self.krn)
+            add_jitter(self.krn)
+            self.krnchd = cholesky(self.krn, self.upcast)
             self.wt = tc.cholesky_solve(
                 self.y[..., None], self.krnchd
             ).squeeze_(-1)
+            self.clear_test_kernel()
             self.need_upd = False
         return None
 
     def predict(self, xp: Tensor, var: str = "full") -> Sequence[Tensor]:
 
         self.update()
+        xp = xp.to(self.x)
+
+        if var not in ("full", "diag"):
+            ys = self.cov.kernel_mv(self.params, self.x, self.wt, xp)
+            return [ys, NotImplemented]
+
         krns = self.cov.kernel(self.params, self.x, xp)
         ys = tc.bmm(
             krns.view(-1, *krns.shape[-2:]),
@@ -86,42 +160,133 @@ class Exact_GP(GPR):
 
         if var == "full":
             covars = self.predict_covar(xp, krns=krns)
-        elif var == "diag":
-            covars = self.predict_var(xp, krns=krns)
         else:
-            covars = NotImplemented
+            covars = self.predict_var(xp, krns=krns)
 
         return [ys, covars]
 
+    def predict_batched(
+        self, xp: Tensor, batch_size: int, var: str = "diag"
+    ) -> Sequence[Tensor]:
+
+        if var not in ("diag", "none"):
+            raise ValueError(
+                f"predict_batched supports var='diag' or 'none', got {var!r}"
+            )
+
+        self.update()
+        xp = xp.to(self.x)
+
+        ys = []
+        covars = []
+
+        for xpb in xp.split(batch_size, dim=-2):
+            if var == "diag":
+                krns = self.cov.kernel(self.params, self.x, xpb)
+                ys.append(tc.matmul(krns, self.wt[..., None]).squeeze(-1))
+                krnss = self.cov.kernel(self.params, xpb)
+                covars.append(self.predict_var(xpb, krns=krns, krnss=krnss))
+            else:
+                kv = self.cov.kernel_mv(self.params, self.x, self.wt, xpb)
+                ys.append(kv)
+
+        if var == "diag":
+            return [tc.cat(ys, dim=-1), tc.cat(covars, dim=-1)]
+
+        return [tc.cat(ys, dim=-1), NotImplemented]
+
+    def get_test_kernel(self, xp: Tensor) -> Tensor:
+        key = (xp, xp._version, self.params, self.params._version)
+        xp_c, xp_v, params_c, params_v = self._krnss_key
+        if (
+            xp_c is not xp
+            or xp_v != key[1]
+            or params_c is not self.params
+            or params_v != key[3]
+        ):
+            self._krnss = self.cov.kernel(self.params, xp)
+            self._krnss_key = key
+        return self._krnss
+
+    def clear_test_kernel(self) -> None:
+        self._krnss = NotImplemented
+        self._krnss_key = (None, -1, None, -1)
+        return None
+
     def predict_var(self, xp: Tensor, **kwargs: Tensor) -> Tensor:
         krns = kwargs["krns"]
-        krnss = self.cov.kernel(self.params, xp)
+        krnss = kwargs.get("krnss")
+        if krnss is None:
+            krnss = self.get_test_kernel(xp)
         krnst = krns.transpose(-2, -1)
         lks = tc.cholesky_solve(krnst, self.krnchd)
 
-        var = tc.diagonal(krnss, dim1=-2, dim2=-1).sub_(
-            krns.mul_(lks.transpose(-2, -1)).sum(-1)
+        var = tc.diagonal(krnss, dim1=-2, dim2=-1).sub(
+            krns.mul(lks.transpose(-2, -1)).sum(-1)
         )
 
         return var
 
     def predict_covar(self, xp: Tensor, **kwargs: Tensor) -> Tensor:
         krns = kwargs["krns"]
-        krnss = self.cov.kernel(self.params, xp)
+        krnss = kwargs.get("krnss")
+        if krnss is None:
+            krnss = self.get_test_kernel(xp)
         krnst = krns.transpose(-2, -1)
         lks = tc.cholesky_solve(krnst, self.krnchd)
 
-        covars = krnss.sub_(
-            tc.bmm(
-                krns.view(-1, *krns.shape[-2:]), lks.view(-1, *lks.shape[-2:])
-            ).squeeze()
-        )
+        covars = krnss.sub(krns @ lks)
 
         return covars
 
 
 # Docs hereafter
 
+GPR.__init__.__doc__ = """
+Parameters
+----------
+x: Tensor[..., n, dim]
+    Training samples.
+y: Tensor[..., n]
+    Training targets.
+cov: Covar
+    Covariance kernel.
+device: str, optional
+    Device x and y are moved to. Defaults to the device of x and y.
+dtype: tc.dtype, optional
+    Floating point type x and y are cast to. Kernels and solves are
+    evaluated in this type. Defaults to float64; lower precision has
+    to be asked for explicitly.
+upcast: bool, optional
+    If True, the Cholesky factorisations are done in float64 and cast
+    back to dtype. Only useful with a lower precision dtype.
+"""
+
+GPR.scratch.__doc__ = """
+Work buffer reused across calls with the same shape, e.g. by the
+loss functions called repeatedly from an optimizer. The buffer is
+reallocated if the shape, dtype or device changes, and its contents
+are overwritten by the next user of the same name.
+
+Parameters
+----------
+name: str
+    Name of the buffer.
+shape: List[int]
+    Required shape of the buffer.
+
+Returns
+-------
+Tensor[shape]
+    Uninitialised buffer of the dtype and device of the samples.
+"""
+
+GPR.release_scratch.__doc__ = """
+Free the work buffers of :obj:GPR.scratch. Called by set_params, so
+the buffers used during hyperparameter optimisation are released once
+the optimiser sets the result.
+"""
+
 GPR.predict.__doc__ = """
 Get Gaussian process mean prediction with covariance for xp.
 
@@ -134,7 +299,8 @@ xp: Tensor[..., np, dim]
 var: string, optional
     If "full" computes the full prediction covariance
     if "diag" computes only diagonal of the prediction covariance.
-    else do not computes covariance
+    else do not computes covariance, and the mean is computed with
+    :obj:Covar.kernel_mv without forming the kernel matrix.
 
 Returns
 -------
@@ -156,7 +322,9 @@ xp: Tensor[..., np, dim]
     It should be atleast 2D tensor.
 
 **kwargs: Tensor
-    Keyword arguments.
+    Keyword arguments. krns is the train-test kernel K(xp, x); the
+    optional krnss is the test kernel K(xp, xp), computed and cached
+    if not given.
 
 Returns
 -------
@@ -175,10 +343,61 @@ xp: Tensor[..., np, dim]
     It should be atleast 2D tensor.
 
 **kwargs: Tensor
-    Keyword arguments.
+    Keyword arguments. krns is the train-test kernel K(xp, x); the
+    optional krnss is the test kernel K(xp, xp), computed and cached
+    if not given.
 
 Returns
 -------
 Tensor[np, np]
     The covariance matrix of targets at xp.
 """
+
+Exact_GP.predict_batched.__doc__ = """
+Gaussian process mean prediction, and optionally variance, for xp
+evaluated over batches of batch_size test samples. Only one batch of
+the test-train kernel is held in memory at a time.
+
+Parameters
+----------
+xp: Tensor[..., np, dim]
+    Batched Evaluation samples at which the interpolation is required.
+    It should be atleast 2D tensor.
+batch_size: int
+    Number of test samples evaluated at once.
+var: string, optional
+    If "diag" computes the variance of the prediction, if "none" only
+    the mean. The full covariance is not available batchwise. The test
+    kernel of each batch is computed afresh and not cached.
+
+Returns
+-------
+[ Tensor[..., np], Tensor[..., np] ]
+    If var is "diag" , returns mean and variance.
+    If var is "none", returns mean and NotImplented
+
+Raises
+------
+ValueError
+    If var is neither "diag" nor "none".
+"""
+
+Exact_GP.get_test_kernel.__doc__ = """
+Covariance kernel K(xp, xp) of the test samples. The last result is
+cached and reused while xp and the model parameters are the same
+tensor objects and neither has been modified in place since.
+
+Parameters
+----------
+xp: Tensor[..., np, dim]
+    Batched test samples.
+
+Returns
+-------
+Tensor[..., np, np]
+    Kernel matrix of xp. Must not be modified in place.
+"""
+
+Exact_GP.clear_test_kernel.__doc__ = """
+Release the cached test kernel of :obj:Exact_GP.get_test_kernel.
+"""
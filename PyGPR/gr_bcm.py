@@ -3,9 +3,7 @@ import numpy as np
 import scipy.optimize as opt
 import matplotlib.pyplot as plt
 #import opt_einsum as oen
-from .gpr import GPR, Exact_GP
-
-tc.set_default_tensor_type(tc.DoubleTensor)
+from .gpr import GPR, Exact_GP, cholesky
 
 
 class GRBCM(GPR):
@@ -16,8 +14,8 @@ class GRBCM(GPR):
         ng = xg.shape[0]
         dim = xg.shape[1]
 
-        tmpx = tc.empty([nc, ng, dim])
-        tmpy = tc.empty([nc, ng])
+        tmpx = xg.new_empty([nc, ng, dim])
+        tmpy = yg.new_empty([nc, ng])
 
         tmpx.copy_(xg)
         tmpy.copy_(yg)
@@ -51,7 +49,7 @@ class GRBCM(GPR):
 
     def train(self, method='CG', jac=True):
 
-        self.gpl.llhd = tc.empty(self.gpl.x.shape[0])
+        self.gpl.llhd = self.gpl.x.new_empty(self.gpl.x.shape[0])
         self.gpl.jac_llhd = tc.empty_like(self.gpl.hp)
 
         if jac:
@@ -98,9 +96,8 @@ class GRBCM(GPR):
 
     def aggregate_full_covar(self, beta, covars_g, covars_l):
         covar_gl = tc.cat((covars_g[None, :, :], covars_l))
-        covar_gl_chd = tc.cholesky(covar_gl)
-        idt = tc.empty_like(covar_gl).copy_(tc.eye(covar_gl.shape[-1]))
-        prec_gl = tc.cholesky_solve(idt, covar_gl_chd)
+        covar_gl_chd = cholesky(covar_gl)
+        prec_gl = tc.cholesky_inverse(covar_gl_chd)
 
         beta_covar = tc.empty_like(prec_gl)
 
@@ -109,7 +106,7 @@ class GRBCM(GPR):
 
         #prec = oen.contract('c,cij->ij', beta, prec_gl, backend='torch')
         prec = prec_gl.mul_(beta_covar).sum(0)
-        covars = tc.cholesky_inverse(tc.cholesky(prec))
+        covars = tc.cholesky_inverse(cholesky(prec))
 
         return covars
 
@@ -122,8 +119,8 @@ class GRBCM(GPR):
             var_g = tc.diag(covars_g)
             var_l = tc.diagonal(covars_l, dim1=-2, dim2=-1)
 
-        beta = tc.empty(self.nc + 1, ys_g.shape[-1])
-        prec = tc.empty(self.nc + 1, ys_g.shape[-1])
+        beta = ys_g.new_empty(self.nc + 1, ys_g.shape[-1])
+        prec = ys_g.new_empty(self.nc + 1, ys_g.shape[-1])
 
         prec[0, :] = var_g.reciprocal_()
         prec[1:, :] = var_l.reciprocal()
@@ -158,7 +155,7 @@ class GRBCM(GPR):
 def log_likelihood_batched(x, y, hp, cov, **kwargs):
 
     krn = cov(x, hp=hp, **kwargs)
-    krnchd = tc.cholesky(krn)
+    krnchd = cholesky(krn)
 
     y = y.view(-1, y.shape[-1], 1)
 
@@ -167,9 +164,11 @@ def log_likelihood_batched(x, y, hp, cov, **kwargs):
     wt.squeeze_(2)
     y.squeeze_(2)
 
-    llhd = 0.5 * wt.mul_(y).sum(-1)
-    + tc.log(tc.diagonal(krnchd, dim1=-2, dim2=-1)).sum(-1)
-    + 0.5 * y.shape[-1] * tc.log(tc.tensor(2 * np.pi))
+    llhd = (
+        0.5 * wt.mul_(y).sum(-1)
+        + tc.log(tc.diagonal(krnchd, dim1=-2, dim2=-1)).sum(-1)
+        + 0.5 * y.shape[-1] * np.log(2 * np.pi)
+    )
 
     llhd.squeeze_(0)
 
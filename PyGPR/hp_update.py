@@ -9,7 +9,7 @@ def get_learn_rate(current_param: Tensor, loss_new: Loss, eps: float) -> float:
       where y - y_old ~ O(eps)
     """
 
-    old_params = tc.clone(current_param).numpy()
+    old_params = tc.clone(current_param).cpu().numpy()
 
     f0, J = loss_new.loss_and_grad(old_params)
 
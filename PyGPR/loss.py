@@ -1,10 +1,9 @@
 import torch as tc
 import numpy as np
 from numpy import ndarray
+from torch import Tensor
 from typing import Tuple
-from .gpr import GPR
-
-tc.set_default_tensor_type(tc.DoubleTensor)
+from .gpr import GPR, add_jitter, cholesky
 
 
 class Loss():
@@ -32,100 +31,145 @@ class MLE(Loss):
     """
      Log Marginal Likelihood for hyperparameters.
     """
+    def __init__(self, model: GPR, stream: bool = False) -> None:
+        super().__init__(model)
+        self.stream: bool = stream
+        return None
+
     def loss(self, params: ndarray) -> float:
 
-        krn = self.model.cov.kernel(tc.from_numpy(params), self.model.x)
-        krn.diagonal(dim1=-2, dim2=-1).add_(1e-7)
-        krnchd = tc.cholesky(krn)
+        hp = tc.from_numpy(params).to(self.model.x)
+        krn = self.model.cov.kernel(hp, self.model.x)
+        add_jitter(krn)
+        krnchd = cholesky(krn, self.model.upcast)
 
         y = self.model.y
         y = y.view(-1, y.shape[-1], 1)
 
         wt = tc.cholesky_solve(y, krnchd)
 
-        wt.squeeze_(2)
-        y.squeeze_(2)
+        wt = wt.squeeze(2)
+        y = y.squeeze(2)
 
         llhd = 0.5 * wt.mul_(y).sum(-1) + tc.log(
             tc.diagonal(krnchd, dim1=-2, dim2=-1)).sum(
-                -1) + 0.5 * y.shape[-1] * tc.log(tc.tensor(2 * np.pi))
+                -1) + 0.5 * y.shape[-1] * np.log(2 * np.pi)
 
         llhd.squeeze_(0)
 
-        self.loss_value = llhd.numpy()
+        self.loss_value = llhd.cpu().numpy()
 
-        return llhd.numpy()
+        return llhd.cpu().numpy()
 
     def grad(self, params: ndarray) -> ndarray:
 
-        krn, dkrn = self.model.cov.kernel_and_grad(tc.from_numpy(params),
-                                                   self.model.x)
-        krn.diagonal(dim1=-2, dim2=-1).add_(1e-7)
-        krnchd = tc.cholesky(krn)
+        if self.stream:
+            jac_llhd = self._loss_and_grad_iter(params)[1]
+        else:
+            jac_llhd = self._loss_and_grad(params)[1]
+
+        self.grad_value = jac_llhd.cpu().numpy()
+
+        return jac_llhd.cpu().numpy()
+
+    def loss_and_grad(self, params: ndarray) -> Tuple[float, ndarray]:
+
+        if self.stream:
+            llhd, jac_llhd = self._loss_and_grad_iter(params)
+        else:
+            llhd, jac_llhd = self._loss_and_grad(params)
+
+        self.loss_value = llhd.cpu().numpy()
+        self.grad_value = jac_llhd.cpu().numpy()
+
+        return (llhd.cpu().numpy(), jac_llhd.cpu().numpy())
+
+    def _loss_and_grad(self, params: ndarray) -> Tuple[Tensor, Tensor]:
+
+        x = self.model.x
+        n = x.shape[-2]
+
+        hp = tc.from_numpy(params).to(x)
+        shape = self.model.cov.get_params_shape(x)
+        nhp = shape[-1]
+        nb = x[..., 0, 0].numel()
+
+        # rhs = [y, dK] for a single solve; kernel_and_grad writes dK
+        # into it through a strided [..., nhp, n, n] view.
+        rhs = self.model.scratch("rhs", [nb, n, 1 + nhp * n])
+        out = rhs[:, :, 1:].view(nb, n, nhp, n).transpose(1, 2)
+        out = out.view(shape + [n, n])
+
+        krn, dkrn = self.model.cov.kernel_and_grad(hp, x, out=out)
+        add_jitter(krn)
+        krnchd = cholesky(krn, self.model.upcast)
 
         y = self.model.y
         y = y.view(-1, y.shape[-1], 1)
 
         krnchd = krnchd.view(-1, krnchd.shape[-2], krnchd.shape[-1])
-        dkrn = dkrn.view(-1, dkrn.shape[-3], dkrn.shape[-2], dkrn.shape[-1])
+        dkrn = dkrn.view(nb, nhp, n, n)
 
-        wt = tc.cholesky_solve(y, krnchd)
+        rhs[:, :, :1].copy_(y)
+        sol = tc.cholesky_solve(rhs, krnchd)
+
+        wt = sol[:, :, 0]
+        kk = sol[:, :, 1:].view(nb, n, nhp, n)
 
-        wt.squeeze_(2)
-        y.squeeze_(2)
+        y = y.squeeze(2)
 
-        kk = tc.cholesky_solve(dkrn, krnchd[:, None, :, :])
+        llhd = 0.5 * wt.mul(y).sum(-1) + tc.log(
+            tc.diagonal(krnchd, dim1=-2, dim2=-1)).sum(
+                -1) + 0.5 * y.shape[-1] * np.log(2 * np.pi)
 
-        wtb = wt[:, :, None].mul(wt[:, None, :])
-        tr1 = dkrn.mul_(wtb[:, None, :, :]).sum((-1, -2))
-        # tr1 = oes.contract('i,kij,j->k', wt, dkrn, wt, backend='torch')
-        tr2 = tc.diagonal(kk, dim1=-1, dim2=-2).sum(-1)
+        tr1 = tc.matmul(dkrn, wt[:, None, :, None]).squeeze_(-1)
+        tr1 = tr1.mul_(wt[:, None, :]).sum(-1)
+        tr2 = tc.diagonal(kk, dim1=1, dim2=3).sum(-1)
 
         jac_llhd = tr1.sub_(tr2).mul_(-0.5)
 
-        jac_llhd.squeeze_(0)
-
-        self.grad_value = jac_llhd.numpy()
+        return llhd.squeeze(0), jac_llhd.squeeze(0)
 
-        return jac_llhd.numpy()
+    def _loss_and_grad_iter(self, params: ndarray) -> Tuple[Tensor, Tensor]:
 
-    def loss_and_grad(self, params: ndarray) -> Tuple[float, ndarray]:
+        x = self.model.x
+        n = x.shape[-2]
 
-        krn, dkrn = self.model.cov.kernel_and_grad(tc.from_numpy(params),
-                                                   self.model.x)
-        krn.diagonal(dim1=-2, dim2=-1).add_(1e-7)
-        krnchd = tc.cholesky(krn)
+        hp = tc.from_numpy(params).to(x)
+        krn, dkrn_iter = self.model.cov.kernel_and_grad_iter(hp, x)
+        krn = krn.clone()
+        add_jitter(krn)
+        krnchd = cholesky(krn, self.model.upcast)
 
         y = self.model.y
         y = y.view(-1, y.shape[-1], 1)
 
+        krnchd = krnchd.view(-1, n, n)
+
         wt = tc.cholesky_solve(y, krnchd)
-        wt.squeeze_(2)
-        y.squeeze_(2)
-        wtb = wt[:, :, None].mul(wt[:, None, :])
+        wt = wt.squeeze(2)
+        y = y.squeeze(2)
 
-        llhd = 0.5 * wt.mul_(y).sum(-1) + tc.log(
+        llhd = 0.5 * wt.mul(y).sum(-1) + tc.log(
             tc.diagonal(krnchd, dim1=-2, dim2=-1)).sum(
-                -1) + 0.5 * y.shape[-1] * tc.log(tc.tensor(2 * np.pi))
+                -1) + 0.5 * y.shape[-1] * np.log(2 * np.pi)
 
-        llhd.squeeze_(0)
+        jac_llhd = []
 
-        krnchd = krnchd.view(-1, krnchd.shape[-2], krnchd.shape[-1])
-        dkrn = dkrn.view(-1, dkrn.shape[-3], dkrn.shape[-2], dkrn.shape[-1])
-
-        kk = tc.cholesky_solve(dkrn, krnchd[:, None, :, :])
+        for dkrn in dkrn_iter:
+            dkrn = dkrn.view(-1, n, n)
 
-        tr1 = dkrn.mul_(wtb[:, None, :, :]).sum((-1, -2))
-        tr2 = tc.diagonal(kk, dim1=-1, dim2=-2).sum(-1)
+            tr1 = tc.matmul(dkrn, wt[:, :, None]).squeeze_(-1)
+            tr1 = tr1.mul_(wt).sum(-1)
 
-        jac_llhd = tr1.sub_(tr2).mul_(-0.5)
+            kk = tc.cholesky_solve(dkrn, krnchd)
+            tr2 = tc.diagonal(kk, dim1=-2, dim2=-1).sum(-1)
 
-        jac_llhd.squeeze_(0)
+            jac_llhd.append(tr1.sub_(tr2).mul_(-0.5))
 
-        self.loss_value = llhd.numpy()
-        self.grad_value = jac_llhd.numpy()
+        jac_llhd = tc.stack(jac_llhd, dim=-1)
 
-        return (llhd.numpy(), jac_llhd.numpy())
+        return llhd.squeeze(0), jac_llhd.squeeze(0)
 
 
 # Docs hereafter
@@ -173,3 +217,15 @@ Returns
 tuple(float, ndarray[nhp,])
     Loss function and its gradient wrt model parameters.
 """
+
+MLE.__init__.__doc__ = """
+Parameters
+----------
+model: GPR
+    Gaussian process model whose hyperparameters are selected.
+stream: bool, optional
+    If True, the gradient is accumulated one hyperparameter at a time
+    from :obj:Covar.kernel_and_grad_iter, so only a single [n, n]
+    derivative slice is held in memory instead of the full
+    [nhp, n, n] stack. Slower, as each slice gets its own solve.
+"""
@@ -5,8 +5,6 @@ from .loss import Loss
 import scipy.optimize as scopt
 from typing import Callable
 
-tc.set_default_tensor_type(tc.DoubleTensor)
-
 
 class Opt:
     """
@@ -43,7 +41,7 @@ class CG(Opt):
         self.res: scopt.OptimizeResult = NotImplemented
 
     def minimize(self) -> None:
-        params = tc.clone(self.loss.model.params).numpy()
+        params = tc.clone(self.loss.model.params).cpu().numpy()
 
         self.fstr = open("opt.dat", "w")
 
@@ -96,7 +94,7 @@ class Nelder_Mead(Opt):
         self.res: scopt.OptimizeResult = NotImplemented
 
     def minimize(self) -> None:
-        params = tc.clone(self.loss.model.params).numpy()
+        params = tc.clone(self.loss.model.params).cpu().numpy()
 
         self.fstr = open("opt.dat", "w")
         self.res = scopt.minimize(
@@ -186,7 +184,7 @@ class CG_Quad(Opt):
 
     def minimize(self, par: ndarray = None) -> int:
 
-        self.x = self.loss.model.params.numpy() if par is None else par
+        self.x = self.loss.model.params.cpu().numpy() if par is None else par
         self.r = self.loss.grad(par)
         self.p = -1.0 * self.r
 
@@ -270,7 +268,7 @@ class BFGS_Quad(Opt):
 
     def minimize(self, par: ndarray = None, H0: ndarray = None):
 
-        self.x = self.loss.model.params.numpy() if par is None else par
+        self.x = self.loss.model.params.cpu().numpy() if par is None else par
         self.r = self.loss.grad(self.x)
         self.HI = (
             np.identity(self.x.shape[-1]) if H0 is None else np.linalg.inv(H0)
@@ -1,7 +1,5 @@
 import torch as tc
 
-tc.set_default_tensor_type(tc.DoubleTensor)
-
 
 class UNIFORM(object):
     def __init__(self, seed):
@@ -10,7 +8,7 @@ class UNIFORM(object):
     def sample(self, n, mins, maxs):
         tc.manual_seed(self.seed)
         dim = len(mins)
-        x = mins + tc.rand(n, dim).mul_(maxs - mins)
+        x = mins + tc.rand(n, dim, dtype=mins.dtype).mul_(maxs - mins)
         return x
 
 
@@ -25,16 +23,16 @@ class MATERN1(UNIFORM):
         tc.manual_seed(self.seed)
 
         dim = len(mins)
-        xc = tc.empty([self.max_count, dim])
+        xc = mins.new_empty([self.max_count, dim])
 
-        xc[0, :] = mins + tc.rand(1, dim).mul_(maxs - mins)
+        xc[0, :] = mins + tc.rand(1, dim, dtype=mins.dtype).mul_(maxs - mins)
 
         k = 1
         count = 1
 
         while k < self.max_count and count < self.max_count:
 
-            x = mins + tc.rand(1, dim).mul_(maxs - mins)
+            x = mins + tc.rand(1, dim, dtype=mins.dtype).mul_(maxs - mins)
 
             dist = tc.sum((xc[:k, :] - x).square_(), 1).sqrt_()
 
@@ -69,9 +67,11 @@ class MATERN1(UNIFORM):
         nc = xc.shape[0]
         dim = xc.shape[1]
 
-        xpart = tc.empty([nc, ns, dim])
+        xpart = xc.new_empty([nc, ns, dim])
 
-        x = mins + tc.rand(10 * ns * nc, dim).mul_(maxs - mins)
+        x = mins + tc.rand(10 * ns * nc, dim, dtype=mins.dtype).mul_(
+            maxs - mins
+        )
 
         dist = euclidean_dist(x, xc)
 
@@ -107,7 +107,7 @@ def cluster_samples(x, xc):
     assert n % nc == 0
     ns = n // nc
 
-    xpart = tc.empty([nc, ns, x.shape[-1]])
+    xpart = x.new_empty([nc, ns, x.shape[-1]])
 
     dist = euclidean_dist(x, xc)
 
@@ -125,9 +125,9 @@ def sample_gp(x, cov, hp=None, mean=None, **kwargs):
         hp = cov(x)
 
     krn = cov(x, hp=hp, **kwargs)
-    krn_chd = tc.cholesky(krn, upper=False)
+    krn_chd = tc.linalg.cholesky(krn)
 
-    N = tc.randn(x.shape[-2])
+    N = tc.randn(x.shape[-2], dtype=krn_chd.dtype)
 
     if mean is None:
         f = tc.mv(krn_chd, N)
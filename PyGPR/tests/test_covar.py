@@ -3,6 +3,7 @@ from typing import Sequence
 
 # from gpr import log_likelihood, jac_log_likelihood
 from PyGPR import Squared_exponential, Covar, Compose, White_noise
+from PyGPR import covar
 from itertools import product
 import pytest as pyt
 
@@ -82,9 +83,17 @@ compose = Compose(
 )
 
 
-covars = (Squared_exponential(), White_noise(), compose)
+covars = (
+    Squared_exponential(),
+    Squared_exponential(exact_distance=True),
+    White_noise(),
+    compose,
+)
+
+sq_exp_compiled = Squared_exponential(use_compile=True)
 
 tparams2 = list(product(covars, n, dim))
+tparams3 = list(product(covars, n, np, dim))
 
 
 @pyt.mark.parametrize("cov, n, dim", tparams2)
@@ -137,6 +146,142 @@ def test_covar_batch(cov: Covar, n: int, dim: int) -> None:
     return None
 
 
+@pyt.mark.parametrize("cov, n, np, dim", tparams3)
+def test_covar_mv(
+    cov: Covar, n: int, np: int, dim: int, tol: float = 1e-7
+) -> None:
+    x = tc.rand(n, dim)
+    xp = tc.rand(np, dim)
+    v = tc.rand(n)
+    hp = tc.rand(cov.get_params_shape(x))
+
+    kv = cov.kernel_mv(hp, x, v, xp=xp)
+    kv_self = cov.kernel_mv(hp, x, v)
+
+    krn = cov.kernel(hp, x, xp=xp).expand(np, n)
+
+    assert tc.allclose(kv, tc.mv(krn, v), atol=tol)
+    assert tc.allclose(kv_self, tc.mv(cov.kernel(hp, x), v), atol=tol)
+
+    return None
+
+
+@pyt.mark.parametrize("nc, n, np, dim", list(product((1, 3), n, np, dim)))
+def test_covar_mv_keops(
+    nc: int, n: int, np: int, dim: int, tol: float = 1e-7
+) -> None:
+    pyt.importorskip("pykeops")
+
+    cov = Squared_exponential(use_keops=True)
+    cov_d = Squared_exponential()
+
+    x = tc.rand(nc, n, dim).squeeze(0)
+    xp = tc.rand(np, dim)
+    v = tc.rand(nc, n).squeeze(0)
+    hp = tc.rand(cov.get_params_shape(x))
+
+    kv = cov.kernel_mv(hp, x, v, xp=xp)
+    kv_self = cov.kernel_mv(hp, x, v)
+
+    assert tc.allclose(kv, cov_d.kernel_mv(hp, x, v, xp=xp), atol=tol)
+    assert tc.allclose(kv_self, cov_d.kernel_mv(hp, x, v), atol=tol)
+
+    return None
+
+
+@pyt.mark.parametrize("n, dim", list(product(n[:2], dim)))
+def test_covar_compile(n: int, dim: int) -> None:
+    x = tc.rand(n, dim)
+    xp = tc.rand(n + 1, dim)
+    hp = tc.rand(sq_exp_compiled.get_params_shape(x))
+
+    cov = Squared_exponential()
+
+    krn, dkrn = sq_exp_compiled.kernel_and_grad(hp, x)
+    krn_e, dkrn_e = cov.kernel_and_grad(hp, x)
+
+    assert tc.allclose(krn, krn_e)
+    assert tc.allclose(dkrn, dkrn_e)
+    assert tc.allclose(
+        sq_exp_compiled.kernel(hp, x, xp), cov.kernel(hp, x, xp)
+    )
+
+    return None
+
+
+def test_covar_keops_missing(monkeypatch: pyt.MonkeyPatch) -> None:
+    monkeypatch.setattr(covar, "LazyTensor", None)
+
+    with pyt.warns(RuntimeWarning, match="pykeops"):
+        cov = Squared_exponential(use_keops=True)
+
+    assert not cov.use_keops
+
+    return None
+
+
+@pyt.mark.parametrize("cov, n, dim", tparams2)
+def test_covar_noncontiguous(cov: Covar, n: int, dim: int) -> None:
+    xt = tc.rand(dim, n)
+    x = xt.t()
+    hp = tc.rand(cov.get_params_shape(x))
+
+    krn, dkrn = cov.kernel_and_grad(hp, x)
+    krn_c, dkrn_c = cov.kernel_and_grad(hp, x.contiguous())
+
+    assert x.shape == (n, dim)
+    assert tc.allclose(krn, krn_c)
+    assert tc.allclose(dkrn, dkrn_c)
+
+    return None
+
+
+@pyt.mark.parametrize("cov, n, dim", list(product(covars, n[:2], dim)))
+def test_covar_grad_torch(
+    cov: Covar, n: int, dim: int, monkeypatch: pyt.MonkeyPatch
+) -> None:
+    nc = 3
+    xb = tc.rand(nc, n, dim)
+    hpb = tc.rand(cov.get_params_shape(xb))
+    nhp = hpb.shape[-1]
+
+    buf = tc.zeros(nc, n, 1 + nhp * n)
+    out = buf[:, :, 1:].view(nc, n, nhp, n).transpose(1, 2)
+
+    krn, dkrn = cov.kernel_and_grad(hpb, xb)
+    cov.kernel_and_grad(hpb, xb, out=out)
+    dkrn_o = out.clone()
+
+    monkeypatch.setattr(covar, "_sq_exp_grad", None)
+
+    krn_t, dkrn_t = cov.kernel_and_grad(hpb, xb)
+    cov.kernel_and_grad(hpb, xb, out=out.zero_())
+
+    assert tc.allclose(krn_t, krn)
+    assert tc.allclose(dkrn_t, dkrn)
+    assert tc.allclose(dkrn_o, dkrn)
+    assert tc.allclose(out, dkrn)
+
+    return None
+
+
+@pyt.mark.parametrize("cov, n, dim", tparams2)
+def test_covar_grad_iter(cov: Covar, n: int, dim: int) -> None:
+    nc = 3
+    xb = tc.rand(nc, n, dim)
+    hpb = tc.rand(cov.get_params_shape(xb))
+
+    krn, dkrn = cov.kernel_and_grad(hpb, xb)
+    krn_it, dkrn_iter = cov.kernel_and_grad_iter(hpb, xb)
+
+    dkrn_it = tc.stack(list(dkrn_iter), dim=-3)
+
+    assert tc.allclose(krn_it, krn)
+    assert tc.allclose(dkrn_it, dkrn)
+
+    return None
+
+
 @pyt.mark.parametrize("cov, n, dim", tparams2)
 def test_covar_deriv(
     cov: Covar, n: int, dim: int, eps_diff: float = 1e-5
@@ -147,16 +292,13 @@ def test_covar_deriv(
 
     krn, dkrn = cov.kernel_and_grad(hp, x)
 
-    dkrn_diff = tc.ones_like(dkrn)
+    hp_eps = hp.add(eps_diff * tc.eye(nhp))
+    x_eps = tc.empty(nhp, n, dim).copy_(x)
 
-    for k in range(0, nhp):
-        eps = tc.zeros_like(hp)
-        eps[k] = eps_diff
-
-        krn = cov.kernel(hp, x)
-        krn_eps = cov.kernel(hp.add(eps), x)
+    krn = cov.kernel(hp, x)
+    krn_eps = cov.kernel(hp_eps, x_eps)
 
-        dkrn_diff[k, :, :] = krn_eps.sub_(krn).div_(eps_diff)
+    dkrn_diff = krn_eps.sub_(krn).div_(eps_diff)
 
     assert tc.allclose(dkrn, dkrn_diff, atol=eps_diff)
 
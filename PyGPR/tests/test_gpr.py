@@ -1,5 +1,6 @@
 import torch as tc
 from PyGPR import Exact_GP
+from PyGPR.gpr import cholesky
 from PyGPR import Covar, Squared_exponential, White_noise, Compose
 from itertools import product
 import pytest as pyt
@@ -32,6 +33,47 @@ def test_interpolate(n: int, dim: int, covars: Covar) -> None:
     assert tc.all(tc.diag(covar_s) < 1e6)
 
 
+@pyt.mark.parametrize("n,dim,covars", tparams)
+def test_interpolate_mean(n: int, dim: int, covars: Covar) -> None:
+    x = tc.rand(n, dim)
+    y = tc.sin(-x.sum(-1))
+
+    cov = Compose(covars)
+
+    xs = tc.rand(n, dim)
+
+    gp = Exact_GP(x, y, cov)
+
+    ys, covar_s = gp.predict(xs, var="none")
+    ys_full, _ = gp.predict(xs, var="diag")
+
+    assert covar_s is NotImplemented
+    assert tc.allclose(ys, ys_full)
+
+
+@pyt.mark.parametrize("n,dim,covars", tparams)
+def test_interpolate_batched(n: int, dim: int, covars: Covar) -> None:
+    x = tc.rand(n, dim)
+    y = tc.sin(-x.sum(-1))
+
+    cov = Compose(covars)
+
+    xs = tc.rand(2 * n + 1, dim)
+
+    gp = Exact_GP(x, y, cov)
+
+    ys, var_s = gp.predict(xs, var="diag")
+    ys_b, var_b = gp.predict_batched(xs, n // 3, var="diag")
+    ys_m, _ = gp.predict_batched(xs, n // 3, var="none")
+
+    assert tc.allclose(ys_b, ys)
+    assert tc.allclose(ys_m, ys)
+    assert tc.allclose(var_b, var_s)
+
+    with pyt.raises(ValueError):
+        gp.predict_batched(xs, n // 3, var="full")
+
+
 @pyt.mark.parametrize("n,dim,covars", tparams)
 def test_pred_covar(
     n: int, dim: int, covars: Covar, tol: float = 1e-7
@@ -46,12 +88,89 @@ def test_pred_covar(
     gp = Exact_GP(x, y, cov)
 
     ys, covar_s = gp.predict(xs)
-    eig = tc.eig(covar_s)[0][:, 0]
+    eig = tc.linalg.eigvalsh(covar_s)
 
     assert tc.allclose(covar_s, covar_s.t(), atol=tol)
     assert tc.all(eig > -tol)
 
 
+@pyt.mark.parametrize("n,dim,covars", tparams)
+def test_test_kernel_inplace(n: int, dim: int, covars: Covar) -> None:
+    x = tc.rand(n, dim)
+    y = tc.sin(-x.sum(-1))
+
+    cov = Compose(covars)
+
+    xs = tc.rand(n, dim)
+
+    gp = Exact_GP(x, y, cov)
+    gp.predict(xs)
+
+    xs.mul_(5.0)
+    _, covar_s = gp.predict(xs)
+    _, covar_r = Exact_GP(x, y, cov).predict(xs)
+
+    assert tc.allclose(covar_s, covar_r)
+
+    gp.params.mul_(2.0)
+    gp.need_upd = True
+    _, covar_s = gp.predict(xs)
+
+    gp_r = Exact_GP(x, y, cov)
+    gp_r.set_params(gp.params)
+    _, covar_r = gp_r.predict(xs)
+
+    assert tc.allclose(covar_s, covar_r)
+
+
+@pyt.mark.parametrize(
+    "n,dim,covars,upcast", list(product(n, dim, covars, (False, True)))
+)
+def test_interpolate_float32(
+    n: int, dim: int, covars: Covar, upcast: bool
+) -> None:
+    x = tc.rand(n, dim)
+    y = tc.sin(-x.sum(-1))
+
+    cov = Compose(covars)
+
+    xs = tc.rand(n, dim)
+
+    gp = Exact_GP(x, y, cov)
+    gp_f = Exact_GP(
+        x, y, cov, device="cpu", dtype=tc.float32, upcast=upcast
+    )
+
+    params = gp.params.clone()
+    params[-1] = 0.1
+    gp.set_params(params)
+    gp_f.set_params(params)
+
+    ys, var_s = gp.predict(xs, var="diag")
+    ys_f, var_f = gp_f.predict(xs, var="diag")
+
+    assert ys_f.dtype == tc.float32 and var_f.dtype == tc.float32
+    assert tc.allclose(ys_f.double(), ys, atol=1e-4)
+    assert tc.allclose(var_f.double(), var_s, atol=1e-4)
+
+
+@pyt.mark.parametrize("n,dim", list(product((100, 500), dim)))
+def test_interpolate_float32_default(n: int, dim: int) -> None:
+    x = tc.rand(n, dim, dtype=tc.float32)
+    y = tc.sin(-x.sum(-1))
+
+    cov = Compose([Squared_exponential(), White_noise()])
+
+    gp = Exact_GP(x, y, cov, dtype=tc.float32)
+    ys, var_s = gp.predict(x, var="diag")
+
+    assert ys.dtype == tc.float32
+    assert tc.allclose(ys, y, atol=1e-2)
+    assert tc.all(tc.isfinite(var_s))
+
+    assert Exact_GP(x, y, cov).x.dtype == tc.float64
+
+
 nc = (2, 5, 10)
 tparams = list(product(nc, n, dim, covars))
 
@@ -92,9 +211,59 @@ def test_pred_covar_batch(
     gp = Exact_GP(x, y, cov)
 
     ys, covar_s = gp.predict(xs)
-    eig = tc.symeig(covar_s)[0]
+    eig = tc.linalg.eigvalsh(covar_s)
 
     assert covar_s.shape == (nc, n, n)
     assert tc.all(tc.diagonal(covar_s, dim1=-2, dim2=-1) < 1e-6)
     assert tc.allclose(covar_s, covar_s.transpose(-2, -1), atol=tol)
     assert tc.all(eig > -tol)
+
+
+class _OffCPU(tc.Tensor):
+    """
+     CPU tensor reporting a non-CPU device until moved with cpu().
+    """
+
+    @property
+    def device(self) -> tc.device:
+        return tc.device("meta")
+
+    def cpu(self) -> tc.Tensor:
+        return self.as_subclass(tc.Tensor)
+
+
+@pyt.mark.parametrize(
+    "dtype,upcast", list(product((tc.float32, tc.float64), (False, True)))
+)
+def test_cholesky_oom_retry(
+    dtype: tc.dtype, upcast: bool, monkeypatch: pyt.MonkeyPatch
+) -> None:
+    a = tc.rand(20, 20, dtype=dtype)
+    krn = a @ a.t() + tc.eye(20, dtype=dtype)
+
+    linalg_cholesky = tc.linalg.cholesky
+    devices = []
+
+    def cholesky_oom(krn: tc.Tensor) -> tc.Tensor:
+        devices.append(krn.device.type)
+        if krn.device.type != "cpu":
+            raise RuntimeError("CUDA out of memory")
+        return linalg_cholesky(krn)
+
+    monkeypatch.setattr(tc.linalg, "cholesky", cholesky_oom)
+
+    krnchd = cholesky(krn.as_subclass(_OffCPU), upcast)
+
+    assert devices == ["meta", "cpu"]
+    assert krnchd.dtype == dtype
+    assert krnchd.device == tc.device("meta")
+    krnchd_r = linalg_cholesky(krn.double() if upcast else krn).to(dtype)
+    assert tc.allclose(krnchd.as_subclass(tc.Tensor), krnchd_r)
+
+    def cholesky_fail(krn: tc.Tensor) -> tc.Tensor:
+        raise RuntimeError("not positive definite")
+
+    monkeypatch.setattr(tc.linalg, "cholesky", cholesky_fail)
+
+    with pyt.raises(RuntimeError, match="positive definite"):
+        cholesky(krn.as_subclass(_OffCPU), upcast)
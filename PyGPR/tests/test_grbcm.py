@@ -5,6 +5,8 @@ from PyGPR import Squared_exponential, White_noise, Compose
 from itertools import product
 import pytest as pyt
 
+tc.set_default_tensor_type(tc.DoubleTensor)
+
 dim = (2, 3, 7)
 n = (10, 50, 100)
 nc = (2, 5, 10)
@@ -42,3 +42,62 @@ def test_grad(n: int, dim: int, eps_diff: float = 1e-8) -> None:
         grad_diff[k] = (val_eps - val) / eps_diff
 
     assert np.max(np.abs(grad - grad_diff)) < 1e-3
+
+
+@pyt.mark.parametrize("n, dim", tparams)
+def test_grad_stream(n: int, dim: int) -> None:
+    x = tc.rand([n, dim])
+    y = tc.exp(-x.square().sum(1))
+
+    cov = Compose([Squared_exponential(), White_noise()])
+
+    mod = Exact_GP(x, y, cov)
+
+    loss = MLE(mod)
+    loss_stream = MLE(mod, stream=True)
+
+    params = tc.rand_like(mod.params).numpy()
+
+    llhd, grad = loss.loss_and_grad(params)
+    llhd_s, grad_s = loss_stream.loss_and_grad(params)
+
+    assert np.allclose(llhd_s, llhd)
+    assert np.allclose(grad_s, grad)
+    assert np.allclose(loss_stream.grad(params), grad)
+
+
+@pyt.mark.parametrize("n, dim, upcast", list(product(n[:2], dim, (0, 1))))
+def test_loss_and_grad_float32(n: int, dim: int, upcast: bool) -> None:
+    x = tc.rand([n, dim])
+    y = tc.exp(-x.square().sum(1))
+
+    cov = Compose([Squared_exponential(), White_noise()])
+
+    mod = Exact_GP(x, y, cov)
+    mod_f = Exact_GP(x, y, cov, dtype=tc.float32, upcast=bool(upcast))
+
+    params = tc.rand_like(mod.params).numpy()
+    params[-1] = 0.5
+
+    llhd, grad = MLE(mod).loss_and_grad(params)
+    llhd_f, grad_f = MLE(mod_f).loss_and_grad(params)
+
+    assert grad_f.dtype == np.float32
+    assert np.allclose(llhd_f, llhd, rtol=1e-4, atol=1e-3)
+    assert np.allclose(grad_f, grad, rtol=1e-3, atol=1e-3)
+
+
+@pyt.mark.parametrize("n, dim", list(product((100, 500), dim)))
+def test_loss_and_grad_float32_default(n: int, dim: int) -> None:
+    x = tc.rand([n, dim], dtype=tc.float32)
+    y = tc.exp(-x.square().sum(1))
+
+    cov = Compose([Squared_exponential(), White_noise()])
+
+    mod = Exact_GP(x, y, cov, dtype=tc.float32)
+    params = mod.params.numpy()
+
+    llhd, grad = MLE(mod).loss_and_grad(params)
+
+    assert np.isfinite(llhd)
+    assert np.all(np.isfinite(grad))
@@ -9,4 +9,5 @@ setup(name='PyGPR',
       license='MIT',
       packages=['PyGPR'],
       install_requires=['torch', 'numpy', 'scipy'],
+      extras_require={'numba': ['numba'], 'keops': ['pykeops']},
       zip_safe=False)